@@ -18,10 +18,26 @@ from datetime import datetime, UTC
 from pathlib import Path
 
 DB_NAME = "tvfiles.sqlite3"
+BATCH_SIZE = 10_000
+
+SQLITE_PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+PRAGMA mmap_size = 268435456;
+"""
+
+FILES_REMOVED_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_files_removed_null
+ON files(removed_date) WHERE removed_date IS NULL
+"""
 
 
 def connect_db():
-    return sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(DB_NAME, isolation_level=None, cached_statements=256)
+    conn.executescript(SQLITE_PRAGMAS)
+    return conn
 
 
 def init_db(conn):
@@ -54,105 +70,252 @@ def init_db(conn):
     )
     """)
 
-    conn.commit()
+    cur.execute(FILES_REMOVED_INDEX)
 
 
 def utc_now():
     return datetime.now(UTC).isoformat()
 
 
-def record_scan(conn):
+def record_scan(conn, now):
     cur = conn.cursor()
     cur.execute(
         "INSERT INTO scans (scan_date) VALUES (?)",
-        (utc_now(),)
+        (now,)
     )
-    conn.commit()
     return cur.lastrowid
 
 
-def record_dir(conn, dirname):
+def record_dir(conn, dirname, now):
     cur = conn.cursor()
     cur.execute("""
         INSERT OR IGNORE INTO scan_dirs (dirname, first_added)
         VALUES (?, ?)
-    """, (dirname, utc_now()))
-    conn.commit()
+    """, (dirname, now))
+
+
+def walk_files(top):
+    """
+    Yield (dirpath, filenames, dir_fd) for top and every directory below it.
+
+    Where os.scandir accepts a directory fd, each directory is opened
+    relative to its parent so files can be stat'ed against dir_fd instead
+    of re-resolving the full path each time; elsewhere this falls back to
+    os.walk and dir_fd is None. Symlinked directories are never entered,
+    so when top is already resolved every dirpath is too. Unreadable
+    directories are skipped, as os.walk does.
+    """
+    if os.scandir not in os.supports_fd:
+        for root, _, files in os.walk(top):
+            yield root, files, None
+        return
+
+    try:
+        dir_fd = os.open(top, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+
+    try:
+        yield from _walk_fd(top, dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _walk_fd(dirpath, dir_fd):
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(dir_fd) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                if is_dir:
+                    if not entry.is_symlink():
+                        subdirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+    except OSError:
+        return
+
+    yield dirpath, files, dir_fd
+
+    for name in subdirs:
+        try:
+            sub_fd = os.open(
+                name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW,
+                dir_fd=dir_fd
+            )
+        except OSError:
+            continue
+
+        try:
+            yield from _walk_fd(os.path.join(dirpath, name), sub_fd)
+        finally:
+            os.close(sub_fd)
+
+
+def stat_file(root, fname, dir_fd):
+    if dir_fd is None:
+        return os.stat(os.path.join(root, fname))
+    return os.stat(fname, dir_fd=dir_fd)
+
+
+def insert_files(conn, rows, table="files"):
+    before = conn.total_changes
+    conn.executemany(f"""
+        INSERT OR IGNORE INTO {table}
+        (filename, filepath, creation_date, added_date, removed_date)
+        VALUES (?, ?, ?, ?, NULL)
+    """, rows)
+    return conn.total_changes - before
+
+
+def start_bulk_load(conn):
+    """
+    Stage an initial load in an unindexed temp table so the files
+    indexes are built from sorted input instead of per-row inserts.
+    """
+    conn.execute("DROP INDEX IF EXISTS idx_files_removed_null")
+    conn.execute("""
+        CREATE TEMP TABLE files_load (
+            filename TEXT NOT NULL,
+            filepath TEXT NOT NULL,
+            creation_date TEXT,
+            added_date TEXT NOT NULL,
+            removed_date TEXT
+        )
+    """)
 
 
-def scan_directory(conn, dirname):
-    cur = conn.cursor()
-    now = utc_now()
+def finish_bulk_load(conn):
+    before = conn.total_changes
+    conn.execute("""
+        INSERT OR IGNORE INTO files
+        (filename, filepath, creation_date, added_date, removed_date)
+        SELECT filename, filepath, creation_date, added_date, removed_date
+        FROM temp.files_load
+        ORDER BY filename, filepath
+    """)
+    inserted = conn.total_changes - before
+
+    conn.execute("DROP TABLE temp.files_load")
+    conn.execute(FILES_REMOVED_INDEX)
+    return inserted
+
+
+def known_files(conn, top):
+    """
+    Return "filepath\0filename" keys for every row already recorded under
+    top; NUL cannot appear in a path, so the joined key is unambiguous.
+    """
+    prefix = top.rstrip(os.sep) + os.sep
+    cur = conn.execute("""
+        SELECT filepath, filename
+        FROM files
+        WHERE filepath = ? OR substr(filepath, 1, ?) = ?
+    """, (top, len(prefix), prefix))
+    return {f"{filepath}\0{filename}" for filepath, filename in cur}
 
+
+def scan_directory(conn, dirname, now, bulk=False):
+    top = os.path.realpath(dirname)
     total_inserted = 0
+    rows = []
+    table = "temp.files_load" if bulk else "files"
+
+    # rows already in files would be ignored by the insert anyway, so skip
+    # them before paying for a stat
+    known = known_files(conn, top)
+
+    with conn:
+        conn.execute("BEGIN")
+
+        if bulk:
+            start_bulk_load(conn)
+
+        for root_path, files, dir_fd in walk_files(top):
+            file_count = 0
+            key_prefix = root_path + "\0"
+
+            for fname in files:
+                file_count += 1
+                if key_prefix + fname in known:
+                    continue
+
+                try:
+                    stat = stat_file(root_path, fname, dir_fd)
+                    creation_date = datetime.fromtimestamp(
+                        stat.st_ctime, tz=UTC
+                    ).isoformat()
+                except OSError:
+                    creation_date = None
+
+                rows.append((fname, root_path, creation_date, now))
+
+                if len(rows) >= BATCH_SIZE:
+                    total_inserted += insert_files(conn, rows, table)
+                    rows.clear()
+
+            if file_count > 0:
+                print(f"Scanned: {root_path}  | files: {file_count}")
+
+        if rows:
+            total_inserted += insert_files(conn, rows, table)
+
+        if bulk:
+            total_inserted = finish_bulk_load(conn)
 
-    for root, _, files in os.walk(dirname):
-        root_path = str(Path(root).resolve())
-        file_count = 0
-
-        for fname in files:
-            full_path = Path(root) / fname
-            try:
-                stat = full_path.stat()
-                creation_date = datetime.fromtimestamp(
-                    stat.st_ctime, tz=UTC
-                ).isoformat()
-            except OSError:
-                creation_date = None
-
-            cur.execute("""
-                INSERT OR IGNORE INTO files
-                (filename, filepath, creation_date, added_date, removed_date)
-                VALUES (?, ?, ?, ?, NULL)
-            """, (
-                fname,
-                root_path,
-                creation_date,
-                now
-            ))
-
-            if cur.rowcount > 0:
-                total_inserted += 1
-            file_count += 1
-
-        if file_count > 0:
-            print(f"Scanned: {root_path}  | files: {file_count}")
-
-    conn.commit()
     print(f"Total files inserted this scan: {total_inserted}")
 
 
-def update_directories(conn):
+def iter_present_files(dirs):
+    # no stat here, so plain os.walk beats walk_files' per-directory openat
+    for d in dirs:
+        for root_path, _, files in os.walk(os.path.realpath(d)):
+            for fname in files:
+                yield fname, root_path
+
+
+def update_directories(conn, now):
     cur = conn.cursor()
-    now = utc_now()
 
     cur.execute("SELECT dirname FROM scan_dirs")
     dirs = [row[0] for row in cur.fetchall()]
 
-    existing = set()
-    for d in dirs:
-        for root, _, files in os.walk(d):
-            root_path = str(Path(root).resolve())
-            for fname in files:
-                existing.add((fname, root_path))
-
-    cur.execute("""
-        SELECT id, filename, filepath
-        FROM files
-        WHERE removed_date IS NULL
-    """)
+    with conn:
+        cur.execute("BEGIN")
+        cur.execute("""
+            CREATE TEMP TABLE seen (
+                filename TEXT NOT NULL,
+                filepath TEXT NOT NULL
+            )
+        """)
+
+        # index after loading: building it from the full table is cheaper
+        # than maintaining a key through 100k+ unsorted inserts
+        cur.executemany(
+            "INSERT INTO seen (filename, filepath) VALUES (?, ?)",
+            iter_present_files(dirs)
+        )
+        cur.execute("CREATE INDEX temp.idx_seen ON seen(filename, filepath)")
+
+        cur.execute("""
+            UPDATE files
+            SET removed_date = ?
+            WHERE removed_date IS NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM temp.seen s
+                  WHERE s.filename = files.filename
+                    AND s.filepath = files.filepath
+              )
+        """, (now,))
+        removed = cur.rowcount
+
+        cur.execute("DROP TABLE temp.seen")
 
-    removed = 0
-    for file_id, fname, parent in cur.fetchall():
-        if (fname, parent) not in existing:
-            cur.execute("""
-                UPDATE files
-                SET removed_date = ?
-                WHERE id = ?
-            """, (now, file_id))
-            removed += 1
-
-    conn.commit()
     print(f"Files marked as removed: {removed}")
 
 
@@ -169,20 +332,31 @@ def main():
         action="store_true",
         help="Update previously scanned directories"
     )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Fast initial load of a new --dirname root"
+    )
 
     args = parser.parse_args()
 
+    if args.bulk and not args.dirname:
+        parser.error("--bulk requires --dirname")
+
+    # one timestamp for the whole run: the scan row, new files and removals
+    now = utc_now()
+
     conn = connect_db()
     init_db(conn)
-    record_scan(conn)
+    record_scan(conn, now)
 
     if args.dirname:
         dirname = str(Path(args.dirname).resolve())
-        record_dir(conn, dirname)
-        scan_directory(conn, dirname)
+        record_dir(conn, dirname, now)
+        scan_directory(conn, dirname, now, bulk=args.bulk)
 
     if args.update:
-        update_directories(conn)
+        update_directories(conn, now)
 
     conn.close()
 
@@ -17,11 +17,27 @@ Scan a Plex TV library and normalize episode file metadata into SQLite.
 
 import argparse
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, UTC
+from functools import partial
+from io import BytesIO
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import xml.etree.ElementTree as ET
 
+BATCH_SIZE = 10_000
+MAX_WORKERS = 16
+
+SQLITE_PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+PRAGMA mmap_size = 268435456;
+"""
+
 
 # -------------------------
 # helpers
@@ -31,20 +47,52 @@ def utc_now() -> str:
     return datetime.now(UTC).isoformat()
 
 
-def plex_get(base_url: str, token: str, path: str) -> str:
-    r = requests.get(
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=MAX_WORKERS,
+    pool_maxsize=2 * MAX_WORKERS,
+    max_retries=Retry(total=3, backoff_factor=0.2),
+)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+
+def plex_get(base_url: str, token: str, path: str) -> bytes:
+    r = _session.get(
         f"{base_url}{path}",
         headers={"X-Plex-Token": token},
         timeout=60,
     )
     r.raise_for_status()
-    return r.text
+    return r.content
+
+
+def iter_elements(xml: bytes, tag: str):
+    """
+    Parse a Plex response incrementally, yielding each <tag> element and
+    then detaching everything already read from the document root, so the
+    parsed tree stays bounded by the current element rather than growing
+    with the response. The raw response body is still held in full.
+    """
+    root = None
+    for event, elem in ET.iterparse(BytesIO(xml), events=("start", "end")):
+        if root is None:
+            root = elem
+        elif event == "end" and elem.tag == tag:
+            yield elem
+            root.clear()
 
 
 # -------------------------
 # schema
 # -------------------------
 
+def connect_db(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None, cached_statements=256)
+    conn.executescript(SQLITE_PRAGMAS)
+    return conn
+
+
 def init_schema(conn: sqlite3.Connection):
     cur = conn.cursor()
 
@@ -82,7 +130,10 @@ def init_schema(conn: sqlite3.Connection):
     )
     """)
 
-    conn.commit()
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_plex_files_removed_null
+    ON plex_files(removed_date) WHERE removed_date IS NULL
+    """)
 
 
 # -------------------------
@@ -91,10 +142,9 @@ def init_schema(conn: sqlite3.Connection):
 
 def get_tv_library_sections(base_url: str, token: str):
     xml = plex_get(base_url, token, "/library/sections")
-    root = ET.fromstring(xml)
 
     sections = []
-    for d in root.findall(".//Directory"):
+    for d in iter_elements(xml, "Directory"):
         if d.get("type") == "show":
             sections.append({
                 "key": d.get("key"),
@@ -103,120 +153,162 @@ def get_tv_library_sections(base_url: str, token: str):
     return sections
 
 
-# -------------------------
-# sync logic
-# -------------------------
-
-def sync_plex(conn: sqlite3.Connection, base_url: str, token: str):
-    cur = conn.cursor()
-    now = utc_now()
-
-    sections = get_tv_library_sections(base_url, token)
-    print(f"TV libraries found: {len(sections)}")
-
-    seen_files: set[tuple[str, str]] = set()
-    total_files = 0
+def fetch_seasons(base_url: str, token: str, show_key: str):
+    xml = plex_get(base_url, token, show_key)
 
-    for section in sections:
-        print(f"\n▶ Library: {section['title']}")
+    return [
+        (season.get("key"), season.get("index"))
+        for season in iter_elements(xml, "Directory")
+    ]
 
-        xml = plex_get(base_url, token, f"/library/sections/{section['key']}/all")
-        root = ET.fromstring(xml)
 
-        for show in root.findall(".//Directory"):
-            show_key = show.get("key")
-            show_title = show.get("title")
+def fetch_episodes(base_url: str, token: str, season_key: str):
+    xml = plex_get(base_url, token, season_key)
 
-            print(f"  Series: {show_title}")
+    return [
+        (
+            ep.get("key"),
+            ep.get("index"),
+            [part.get("file") for part in ep.iter("Part")],
+        )
+        for ep in iter_elements(xml, "Video")
+    ]
 
-            # --- series ---
-            cur.execute("""
-                INSERT OR IGNORE INTO plex_series
-                (plex_key, title)
-                VALUES (?, ?)
-            """, (show_key, show_title))
 
-            cur.execute(
-                "SELECT id FROM plex_series WHERE plex_key = ?",
-                (show_key,),
-            )
-            series_db_id = cur.fetchone()[0]
+# -------------------------
+# sync logic
+# -------------------------
 
-            # --- seasons ---
-            seasons_xml = plex_get(base_url, token, show_key)
-            seasons_root = ET.fromstring(seasons_xml)
+def insert_plex_files(cur: sqlite3.Cursor, rows: list[tuple]):
+    cur.executemany("""
+        INSERT INTO plex_files
+        (filename, filepath, series_id, episode_id, added_date, removed_date)
+        VALUES (?, ?, ?, ?, ?, NULL)
+        ON CONFLICT(filename, filepath) DO UPDATE SET removed_date = NULL
+        WHERE plex_files.removed_date IS NOT NULL
+    """, rows)
+
+    cur.executemany(
+        "INSERT OR IGNORE INTO seen (filename, filepath) VALUES (?, ?)",
+        [(r[0], r[1]) for r in rows],
+    )
 
-            for season in seasons_root.findall(".//Directory"):
-                season_key = season.get("key")
-                season_number = season.get("index")
 
-                episodes_xml = plex_get(base_url, token, season_key)
-                episodes_root = ET.fromstring(episodes_xml)
+def sync_plex(conn: sqlite3.Connection, base_url: str, token: str):
+    cur = conn.cursor()
+    now = utc_now()
 
-                for ep in episodes_root.findall(".//Video"):
-                    ep_key = ep.get("key")
-                    episode_number = ep.get("index")
+    sections = get_tv_library_sections(base_url, token)
+    print(f"TV libraries found: {len(sections)}")
 
-                    # --- episode ---
+    with conn:
+        cur.execute("BEGIN")
+        cur.execute("""
+            CREATE TEMP TABLE seen (
+                filename TEXT NOT NULL,
+                filepath TEXT NOT NULL,
+                PRIMARY KEY (filename, filepath)
+            ) WITHOUT ROWID
+        """)
+
+        file_rows: list[tuple] = []
+        total_files = 0
+
+        # HTTP fetches fan out over the pool; all SQLite work stays on this thread
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            for section in sections:
+                print(f"\n▶ Library: {section['title']}")
+
+                xml = plex_get(base_url, token, f"/library/sections/{section['key']}/all")
+
+                shows = [
+                    (show.get("key"), show.get("title"))
+                    for show in iter_elements(xml, "Directory")
+                ]
+
+                seasons_by_show = list(pool.map(
+                    partial(fetch_seasons, base_url, token),
+                    [show_key for show_key, _ in shows],
+                ))
+                episodes_by_season = pool.map(
+                    partial(fetch_episodes, base_url, token),
+                    [
+                        season_key
+                        for seasons in seasons_by_show
+                        for season_key, _ in seasons
+                    ],
+                )
+
+                for (show_key, show_title), seasons in zip(shows, seasons_by_show):
+                    print(f"  Series: {show_title}")
+
+                    # --- series ---
                     cur.execute("""
-                        INSERT OR IGNORE INTO plex_episodes
-                        (plex_key, series_id, season_number, episode_number)
-                        VALUES (?, ?, ?, ?)
-                    """, (
-                        ep_key,
-                        series_db_id,
-                        season_number,
-                        episode_number,
-                    ))
-
-                    cur.execute(
-                        "SELECT id FROM plex_episodes WHERE plex_key = ?",
-                        (ep_key,),
-                    )
-                    episode_db_id = cur.fetchone()[0]
-
-                    # --- files ---
-                    for part in ep.findall(".//Part"):
-                        full_path = Path(part.get("file")).resolve()
-                        filepath = str(full_path.parent)
-                        filename = full_path.name
-
-                        seen_files.add((filename, filepath))
-                        total_files += 1
-
-                        cur.execute("""
-                            INSERT OR IGNORE INTO plex_files
-                            (filename, filepath, series_id, episode_id, added_date, removed_date)
-                            VALUES (?, ?, ?, ?, ?, NULL)
-                        """, (
-                            filename,
-                            filepath,
-                            series_db_id,
-                            episode_db_id,
-                            now,
-                        ))
-
-                        cur.execute("""
-                            UPDATE plex_files
-                            SET removed_date = NULL
-                            WHERE filename = ? AND filepath = ?
-                        """, (filename, filepath))
-
-    # --- removed files ---
-    cur.execute("""
-        SELECT filename, filepath
-        FROM plex_files
-        WHERE removed_date IS NULL
-    """)
-    for filename, filepath in cur.fetchall():
-        if (filename, filepath) not in seen_files:
-            cur.execute("""
-                UPDATE plex_files
-                SET removed_date = ?
-                WHERE filename = ? AND filepath = ?
-            """, (now, filename, filepath))
-
-    conn.commit()
+                        INSERT INTO plex_series
+                        (plex_key, title)
+                        VALUES (?, ?)
+                        ON CONFLICT(plex_key) DO UPDATE SET title = excluded.title
+                        RETURNING id
+                    """, (show_key, show_title))
+                    series_db_id = cur.fetchone()[0]
+
+                    # --- seasons ---
+                    for _, season_number in seasons:
+                        for ep_key, episode_number, files in next(episodes_by_season):
+                            # --- episode ---
+                            cur.execute("""
+                                INSERT INTO plex_episodes
+                                (plex_key, series_id, season_number, episode_number)
+                                VALUES (?, ?, ?, ?)
+                                ON CONFLICT(plex_key) DO UPDATE SET
+                                    series_id = excluded.series_id,
+                                    season_number = coalesce(excluded.season_number, season_number),
+                                    episode_number = coalesce(excluded.episode_number, episode_number)
+                                RETURNING id
+                            """, (
+                                ep_key,
+                                series_db_id,
+                                season_number,
+                                episode_number,
+                            ))
+                            episode_db_id = cur.fetchone()[0]
+
+                            # --- files ---
+                            for part_file in files:
+                                full_path = Path(part_file).resolve()
+                                filepath = str(full_path.parent)
+                                filename = full_path.name
+
+                                total_files += 1
+
+                                file_rows.append((
+                                    filename,
+                                    filepath,
+                                    series_db_id,
+                                    episode_db_id,
+                                    now,
+                                ))
+
+                                if len(file_rows) >= BATCH_SIZE:
+                                    insert_plex_files(cur, file_rows)
+                                    file_rows.clear()
+
+        if file_rows:
+            insert_plex_files(cur, file_rows)
+
+        # --- removed files ---
+        cur.execute("""
+            UPDATE plex_files
+            SET removed_date = ?
+            WHERE removed_date IS NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM temp.seen s
+                  WHERE s.filename = plex_files.filename
+                    AND s.filepath = plex_files.filepath
+              )
+        """, (now,))
+
+        cur.execute("DROP TABLE temp.seen")
 
     print("\nSummary:")
     print(f"  files seen: {total_files}")
@@ -234,7 +326,7 @@ def main():
 
     args = p.parse_args()
 
-    conn = sqlite3.connect(args.db)
+    conn = connect_db(args.db)
     init_schema(conn)
     sync_plex(conn, args.plex_url.rstrip("/"), args.plex_token)
     conn.close()
@@ -1,7 +1,7 @@
 #!/usr/bin/env -S uv run
 # /// script
 # requires-python = ">=3.10"
-# dependencies = ["requests"]
+# dependencies = ["requests", "orjson"]
 # ///
 
 """
@@ -18,23 +18,71 @@ Correctly handles:
 
 import argparse
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, UTC
+from functools import partial
 from pathlib import Path
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BATCH_SIZE = 10_000
+MAX_WORKERS = 16
+
+SQLITE_PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+PRAGMA mmap_size = 268435456;
+"""
 
 
 def utc_now():
     return datetime.now(UTC).isoformat()
 
 
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=MAX_WORKERS,
+    pool_maxsize=2 * MAX_WORKERS,
+    max_retries=Retry(total=3, backoff_factor=0.2),
+)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+
 def sonarr_get(base_url, api_key, path):
-    r = requests.get(
+    r = _session.get(
         f"{base_url}/api/v3/{path}",
         headers={"X-Api-Key": api_key},
         timeout=30,
     )
     r.raise_for_status()
-    return r.json()
+    return orjson.loads(r.content)
+
+
+def fetch_series_files(base_url, api_key, series):
+    # Sonarr's episode/episodefile endpoints require a seriesId, so the
+    # cheapest call is the one we skip when the series has no files at all.
+    statistics = series.get("statistics") or {}
+    if statistics.get("episodeFileCount") == 0:
+        return [], []
+
+    episodes = sonarr_get(
+        base_url, api_key, f"episode?seriesId={series['id']}"
+    )
+    episode_files = sonarr_get(
+        base_url, api_key, f"episodefile?seriesId={series['id']}"
+    )
+    return episodes, episode_files
+
+
+def connect_db(path):
+    conn = sqlite3.connect(path, isolation_level=None, cached_statements=256)
+    conn.executescript(SQLITE_PRAGMAS)
+    return conn
 
 
 def init_schema(conn):
@@ -73,7 +121,25 @@ def init_schema(conn):
     )
     """)
 
-    conn.commit()
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_sonarr_files_removed_null
+    ON sonarr_files(removed_date) WHERE removed_date IS NULL
+    """)
+
+
+def insert_sonarr_files(cur, rows):
+    cur.executemany("""
+        INSERT INTO sonarr_files
+        (filepath, series_id, episode_id, added_date, removed_date)
+        VALUES (?, ?, ?, ?, NULL)
+        ON CONFLICT(filepath) DO UPDATE SET removed_date = NULL
+        WHERE sonarr_files.removed_date IS NOT NULL
+    """, rows)
+
+    cur.executemany(
+        "INSERT OR IGNORE INTO seen (filepath) VALUES (?)",
+        [(r[0],) for r in rows],
+    )
 
 
 def sync_sonarr(conn, base_url, api_key):
@@ -83,104 +149,103 @@ def sync_sonarr(conn, base_url, api_key):
     series_list = sonarr_get(base_url, api_key, "series")
     print(f"Series found: {len(series_list)}")
 
-    seen_files = set()
-    total_files = 0
-    resolved_episodes = 0
-    unresolved_files = 0
-
-    for series in series_list:
-        series_api_id = series["id"]
-        title = series["title"]
-
-        print(f"\n▶ {title}")
-
+    with conn:
+        cur.execute("BEGIN")
         cur.execute("""
-            INSERT OR IGNORE INTO sonarr_series
-            (sonarr_id, title, path)
-            VALUES (?, ?, ?)
-        """, (series_api_id, title, series["path"]))
-
-        cur.execute(
-            "SELECT id FROM sonarr_series WHERE sonarr_id = ?",
-            (series_api_id,),
-        )
-        series_db_id = cur.fetchone()[0]
-
-        episodes = sonarr_get(
-            base_url, api_key, f"episode?seriesId={series_api_id}"
-        )
-        episode_by_id = {e["id"]: e for e in episodes}
-
-        episode_files = sonarr_get(
-            base_url, api_key, f"episodefile?seriesId={series_api_id}"
-        )
-
-        print(f"  episode files: {len(episode_files)}")
-
-        for ef in episode_files:
-            filepath = str(Path(ef["path"]).resolve())
-            seen_files.add(filepath)
-            total_files += 1
-
-            episode_id_db = None
-            episode_ids = ef.get("episodeIds") or []
-
-            if episode_ids:
-                ep = episode_by_id.get(episode_ids[0])
-                if ep:
-                    cur.execute("""
-                        INSERT OR IGNORE INTO sonarr_episodes
-                        (sonarr_id, series_id, season_number, episode_number)
-                        VALUES (?, ?, ?, ?)
-                    """, (
-                        ep["id"],
+            CREATE TEMP TABLE seen (
+                filepath TEXT PRIMARY KEY
+            ) WITHOUT ROWID
+        """)
+
+        file_rows = []
+        total_files = 0
+        resolved_episodes = 0
+        unresolved_files = 0
+
+        # HTTP fetches fan out over the pool; results are consumed in series
+        # order as they arrive and all SQLite work stays on this thread
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            fetched = pool.map(
+                partial(fetch_series_files, base_url, api_key),
+                series_list,
+            )
+
+            for series, (episodes, episode_files) in zip(series_list, fetched):
+                series_api_id = series["id"]
+                title = series["title"]
+
+                print(f"\n▶ {title}")
+
+                cur.execute("""
+                    INSERT INTO sonarr_series
+                    (sonarr_id, title, path)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(sonarr_id) DO UPDATE SET
+                        title = excluded.title,
+                        path = excluded.path
+                    RETURNING id
+                """, (series_api_id, title, series["path"]))
+                series_db_id = cur.fetchone()[0]
+
+                episode_by_id = {e["id"]: e for e in episodes}
+
+                print(f"  episode files: {len(episode_files)}")
+
+                for ef in episode_files:
+                    filepath = str(Path(ef["path"]).resolve())
+                    total_files += 1
+
+                    episode_id_db = None
+                    episode_ids = ef.get("episodeIds") or []
+
+                    if episode_ids:
+                        ep = episode_by_id.get(episode_ids[0])
+                        if ep:
+                            cur.execute("""
+                                INSERT INTO sonarr_episodes
+                                (sonarr_id, series_id, season_number, episode_number)
+                                VALUES (?, ?, ?, ?)
+                                ON CONFLICT(sonarr_id) DO UPDATE SET
+                                    series_id = excluded.series_id,
+                                    season_number = excluded.season_number,
+                                    episode_number = excluded.episode_number
+                                RETURNING id
+                            """, (
+                                ep["id"],
+                                series_db_id,
+                                ep.get("seasonNumber"),
+                                ep.get("episodeNumber"),
+                            ))
+                            episode_id_db = cur.fetchone()[0]
+                            resolved_episodes += 1
+                        else:
+                            unresolved_files += 1
+                    else:
+                        unresolved_files += 1
+
+                    file_rows.append((
+                        filepath,
                         series_db_id,
-                        ep.get("seasonNumber"),
-                        ep.get("episodeNumber"),
+                        episode_id_db,
+                        now,
                     ))
 
-                    cur.execute(
-                        "SELECT id FROM sonarr_episodes WHERE sonarr_id = ?",
-                        (ep["id"],),
-                    )
-                    episode_id_db = cur.fetchone()[0]
-                    resolved_episodes += 1
-                else:
-                    unresolved_files += 1
-            else:
-                unresolved_files += 1
-
-            cur.execute("""
-                INSERT OR IGNORE INTO sonarr_files
-                (filepath, series_id, episode_id, added_date, removed_date)
-                VALUES (?, ?, ?, ?, NULL)
-            """, (
-                filepath,
-                series_db_id,
-                episode_id_db,
-                now,
-            ))
-
-            cur.execute("""
-                UPDATE sonarr_files
-                SET removed_date = NULL
-                WHERE filepath = ?
-            """, (filepath,))
-
-    # removed files
-    cur.execute("""
-        SELECT filepath FROM sonarr_files
-        WHERE removed_date IS NULL
-    """)
-    for (path,) in cur.fetchall():
-        if path not in seen_files:
-            cur.execute("""
-                UPDATE sonarr_files
-                SET removed_date = ?
-                WHERE filepath = ?
-            """, (now, path))
+                    if len(file_rows) >= BATCH_SIZE:
+                        insert_sonarr_files(cur, file_rows)
+                        file_rows.clear()
+
+        if file_rows:
+            insert_sonarr_files(cur, file_rows)
+
+        # removed files
+        cur.execute("""
+            UPDATE sonarr_files
+            SET removed_date = ?
+            WHERE removed_date IS NULL
+              AND filepath NOT IN (SELECT filepath FROM temp.seen)
+        """, (now,))
 
-    conn.commit()
+        cur.execute("DROP TABLE temp.seen")
 
     print("\nSummary:")
     print(f"  files seen:      {total_files}")
@@ -196,7 +261,7 @@ def main():
 
     args = p.parse_args()
 
-    conn = sqlite3.connect(args.db)
+    conn = connect_db(args.db)
     init_schema(conn)
     sync_sonarr(conn, args.sonarr_url.rstrip("/"), args.sonarr_api_key)
     conn.close()